@@ -8,24 +8,30 @@ import torch
 import json
 from ollama import AsyncClient
 from src.core.model import (
-    ensureMac,
+    startup_profile,
     determine_device,
+    build_session_asr,
     load_class_material,
     build_system_message,
     load_farewells,
     warmup as model_warmup,
 )
 from src.core.speak import speak
+from src.core.session_asr import SessionASR
+from src.core.deployment import self_test
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
 
 # Async lifespan handler replaces deprecated on_event startup
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global asr, device, client, system_message, conversation_history, FAREWELL_TOKENS
-    # Startup tasks
-    ensureMac()
-    asr, device = determine_device()
+    global profile, asr, device, session_asr, client, system_message, conversation_history, FAREWELL_TOKENS
+    # Startup tasks (RECAP_HEADLESS=1 keeps the server off local audio)
+    profile = startup_profile()
+    asr, device = determine_device(profile)
+    session_asr = build_session_asr(asr, device, profile=profile)
+    if os.getenv("RECAP_SELF_TEST", "1") != "0":
+        self_test(asr, profile)
     class_material = load_class_material()
     system_message = build_system_message(class_material)
     conversation_history = [system_message]
@@ -33,7 +39,7 @@ async def lifespan(app: FastAPI):
     client = AsyncClient()
     # Warm up models and TTS in background
     loop = asyncio.get_running_loop()
-    loop.run_in_executor(None, model_warmup)
+    loop.run_in_executor(None, model_warmup, profile.has_audio_out)
     yield
     # (Optional) Shutdown tasks here
 
@@ -47,8 +53,10 @@ app.mount(
 )
 
 # Globals !!!!
+profile = None
 asr = None
 device = None
+session_asr = None
 client: AsyncClient
 system_message = None
 conversation_history = []
@@ -61,6 +69,8 @@ async def get_index():
 @app.websocket("/ws/chat")
 async def websocket_chat(websocket: WebSocket):
     await websocket.accept()
+    # Per-connection language memory, shared Whisper models
+    ws_asr = SessionASR(session_asr.primary, device, detector=session_asr.detector, fp16=session_asr.fp16)
     try:
         while True:
             # Receive either a text frame or binary frame
@@ -86,11 +96,7 @@ async def websocket_chat(websocket: WebSocket):
                 with tempfile.NamedTemporaryFile(suffix=".webm", delete=False) as tmp:
                     tmp.write(blob)
                     tmp_path = tmp.name
-                result = asr.transcribe(
-                    tmp_path,
-                    fp16=(device != "cpu"),
-                    condition_on_previous_text=False,
-                )
+                result = ws_asr.transcribe(tmp_path)
                 os.remove(tmp_path)
                 user_text = result.get("text", "").strip()
                 user_lang = result.get("language", "en")
@@ -112,7 +118,8 @@ async def websocket_chat(websocket: WebSocket):
                 )
                 farewell = resp["message"]["content"].strip()
                 await websocket.send_text(farewell)
-                speak(farewell, True, language=user_lang)
+                if profile.has_audio_out:
+                    speak(farewell, True, language=user_lang)
                 break
 
             # Build message list (handle non-English)
@@ -133,11 +140,14 @@ async def websocket_chat(websocket: WebSocket):
                     await websocket.send_text(token)
 
             # Play full TTS and save to history
-            speak(reply_accum, True, language=user_lang)
+            if profile.has_audio_out:
+                speak(reply_accum, True, language=user_lang)
             conversation_history.append({"role":"assistant", "content": reply_accum})
 
     except WebSocketDisconnect:
         print("RECAP client disconnected")
+    finally:
+        ws_asr.report()
 
 if __name__ == "__main__":
     import uvicorn
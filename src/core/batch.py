@@ -0,0 +1,356 @@
+# Imports --------------------------------
+import os
+import re
+import json
+import time
+import hashlib
+import queue
+import argparse
+import threading
+import ollama
+import soundfile as sf
+from colorama import Fore, Style, init
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+from model import startup_profile, determine_device, build_session_asr, load_class_material, build_system_message
+from speak import synthesize, SAMPLE_RATE
+from deployment import DeploymentProfile
+
+# Initialize colorama
+init(autoreset=True)
+
+AUDIO_EXTS = {".wav", ".mp3", ".m4a", ".flac", ".ogg", ".webm", ".mp4"}
+TEXT_EXTS = {".txt"}
+
+# End-of-stream marker passed between stages
+_DONE = object()
+
+# Input discovery function ---------------
+def iter_inputs(source: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield work items from a directory (audio and .txt files, recursively)
+    or a manifest. A .jsonl manifest holds one {"id", "path" | "text",
+    "language"?} object per line; any other manifest lists one path per line.
+    Relative paths resolve against the manifest's folder. Text entries without
+    an "id" are keyed by their content, so editing the manifest keeps resume
+    working. Malformed lines come out as "error" items (keyed by the line's
+    content) instead of aborting the run.
+    """
+    if os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                if os.path.splitext(name)[1].lower() in AUDIO_EXTS | TEXT_EXTS:
+                    yield {"id": os.path.relpath(path, source).replace(os.sep, "/"), "path": path}
+        return
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                entry = json.loads(line) if source.endswith(".jsonl") else {"path": line}
+                if not isinstance(entry, dict):
+                    raise ValueError("entry must be a JSON object")
+                if "path" in entry:
+                    entry.setdefault("id", entry["path"])
+                    entry["path"] = os.path.join(base, entry["path"])
+                elif "text" in entry:
+                    entry.setdefault("id", "text-" + _digest(f"{entry.get('language') or ''}\n{entry['text']}"))
+                else:
+                    raise ValueError("entry needs a 'path' or 'text'")
+            except ValueError as e:  # includes json.JSONDecodeError
+                yield {"id": "bad-" + _digest(line), "status": "error", "error": f"{source}:{n}: {e}"}
+                continue
+            yield entry
+
+def _digest(text: str, length: int = 16) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:length]
+
+def _audio_filename(item_id: str) -> str:
+    # Readable stem plus a hash of the full id: unique even for ids that
+    # collide once sanitized (a/b vs a__b) or that are absolute / use ".."
+    stem = os.path.splitext(os.path.basename(str(item_id)))[0]
+    stem = re.sub(r"[^A-Za-z0-9._-]+", "_", stem).strip("._")[:60] or "item"
+    return f"{stem}-{_digest(str(item_id), 8)}.wav"
+
+# Resume function ------------------------
+def load_finished(results_path: str) -> Set[str]:
+    """Ids whose latest result line in `results_path` succeeded."""
+    status: Dict[str, str] = {}
+    if os.path.isfile(results_path):
+        with open(results_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn line from an interrupted run
+                status[rec.get("id")] = rec.get("status")
+    return {item_id for item_id, st in status.items() if st == "ok"}
+
+def _terminate_torn_line(results_path: str) -> None:
+    # An interrupted run can leave a partial last line; close it off so the
+    # next record starts on its own line instead of being glued to it
+    if not os.path.isfile(results_path) or os.path.getsize(results_path) == 0:
+        return
+    with open(results_path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+# Text input function --------------------
+def _is_text_item(item: Dict[str, Any]) -> bool:
+    return "text" in item or os.path.splitext(item["path"])[1].lower() in TEXT_EXTS
+
+def _load_text(item: Dict[str, Any]) -> None:
+    if "text" not in item:
+        with open(item["path"], "r", encoding="utf-8") as f:
+            item["text"] = f.read().strip()
+    item.setdefault("language", "en")
+
+# Pipeline stage -------------------------
+class Stage:
+    """
+    A pool of `workers` threads applying `fn` to items from `inbox` and
+    putting them on `outbox`. Failed items are marked and passed along
+    untouched, so the writer still records them. When the last worker
+    sees end-of-stream it forwards one marker per downstream consumer.
+    """
+
+    def __init__(self, name: str, fn: Callable[[Dict[str, Any]], None], workers: int,
+                 inbox: queue.Queue, outbox: queue.Queue, consumers: int) -> None:
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.inbox = inbox
+        self.outbox = outbox
+        self.consumers = consumers
+        self.items = 0
+        self.busy = 0.0
+        self.first: Optional[float] = None
+        self.last: Optional[float] = None
+        self._alive = workers
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work, name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def join(self) -> None:
+        for t in self._threads:
+            t.join()
+
+    def _work(self) -> None:
+        while True:
+            item = self.inbox.get()
+            if item is _DONE:
+                break
+            if item["status"] == "pending":
+                start = time.perf_counter()
+                try:
+                    self.fn(item)
+                except Exception as e:
+                    item["status"] = "error"
+                    item["error"] = f"{self.name}: {e}"
+                end = time.perf_counter()
+                item["timings"][self.name] = round(end - start, 3)
+                with self._lock:
+                    self.items += 1
+                    self.busy += end - start
+                    self.first = start if self.first is None else min(self.first, start)
+                    self.last = end if self.last is None else max(self.last, end)
+            self.outbox.put(item)
+
+        with self._lock:
+            self._alive -= 1
+            last_out = self._alive == 0
+        if last_out:
+            for _ in range(self.consumers):
+                self.outbox.put(_DONE)
+
+    def stats(self) -> Dict[str, Any]:
+        wall = (self.last - self.first) if self.items else 0.0
+        return {
+            "workers": self.workers,
+            "items": self.items,
+            "busy_s": round(self.busy, 2),
+            "mean_latency_s": round(self.busy / self.items, 3) if self.items else None,
+            "items_per_s": round(self.items / wall, 3) if wall > 0 else None,
+        }
+
+# Batch runner ---------------------------
+def run_batch(
+    source: str,
+    out_dir: str,
+    model: str = "gemma3:4b",
+    asr_workers: int = 1,
+    llm_concurrency: int = 4,
+    tts: bool = False,
+    queue_size: int = 8,
+    fast_short: bool = False,
+    profile: Optional[DeploymentProfile] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Stream every input through ASR -> LLM -> (TTS) and append one JSON line
+    per item to `out_dir`/results.jsonl. Items already answered there are
+    skipped. Returns per-stage throughput.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    results_path = os.path.join(out_dir, "results.jsonl")
+    audio_dir = os.path.join(out_dir, "audio")
+    if tts:
+        os.makedirs(audio_dir, exist_ok=True)
+    finished = load_finished(results_path)
+    _terminate_torn_line(results_path)
+
+    system_message = build_system_message(load_class_material())
+    client = ollama.Client()
+    local = threading.local()
+
+    # Collect work up front: bad entries become error records, and we know
+    # how many Whisper instances are worth loading
+    pending: List[Dict[str, Any]] = []
+    counts = {"ok": 0, "error": 0, "skipped": 0}
+    for item in iter_inputs(source):
+        if item["id"] in finished:
+            counts["skipped"] += 1
+            continue
+        item.setdefault("status", "pending")
+        item["timings"] = {}
+        pending.append(item)
+    n_audio = sum(1 for item in pending if item["status"] == "pending" and not _is_text_item(item))
+    asr_workers = max(1, min(asr_workers, n_audio))
+
+    # Each ASR worker owns its models (Whisper is not safe to share across
+    # threads). Load them one at a time here, not concurrently in the workers.
+    asr_pool: queue.Queue = queue.Queue()
+    for _ in range(min(asr_workers, n_audio)):
+        asr, device = determine_device(profile)
+        asr_pool.put(build_session_asr(asr, device, fast_short=fast_short, profile=profile))
+
+    # Stage functions ------------------
+    def do_asr(item: Dict[str, Any]) -> None:
+        path = item["path"]
+        if not hasattr(local, "asr"):
+            local.asr = asr_pool.get_nowait()
+        # Recordings come from different students: never carry a language over
+        local.asr.set_language(item.get("language"))
+        result = local.asr.transcribe(path)
+        item["text"] = result.get("text", "").strip()
+        item["language"] = result["language"]
+        item["asr_tier"] = result.get("tier")
+        if not item["text"]:
+            raise ValueError("no speech detected")
+
+    def do_llm(item: Dict[str, Any]) -> None:
+        msgs = [system_message]
+        if item["language"] != "en":
+            msgs.append({"role": "system", "content": f"Please respond in {item['language']}."})
+        msgs.append({"role": "user", "content": item["text"]})
+        resp = client.chat(model=model, messages=msgs)
+        item["reply"] = resp["message"]["content"].strip()
+
+    def do_tts(item: Dict[str, Any]) -> None:
+        audio = synthesize(item["reply"], item["language"], interactive=False)
+        wav_path = os.path.join(audio_dir, _audio_filename(item["id"]))
+        sf.write(wav_path, audio, SAMPLE_RATE)
+        item["reply_audio"] = wav_path
+
+    # Graph ----------------------------
+    q_asr: queue.Queue = queue.Queue(maxsize=queue_size)
+    q_llm: queue.Queue = queue.Queue(maxsize=queue_size)
+    q_tts: queue.Queue = queue.Queue(maxsize=queue_size)
+    q_out: queue.Queue = queue.Queue(maxsize=queue_size)
+
+    tts_workers = 2
+    stages = [
+        Stage("asr", do_asr, asr_workers, q_asr, q_llm, llm_concurrency),
+        Stage("llm", do_llm, llm_concurrency, q_llm, q_tts if tts else q_out, tts_workers if tts else 1),
+    ]
+    if tts:
+        stages.append(Stage("tts", do_tts, tts_workers, q_tts, q_out, 1))
+    for stage in stages:
+        stage.start()
+
+    def write_results() -> None:
+        with open(results_path, "a", encoding="utf-8") as f:
+            while True:
+                item = q_out.get()
+                if item is _DONE:
+                    break
+                if item["status"] == "pending":
+                    item["status"] = "ok"
+                counts[item["status"]] += 1
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                f.flush()
+                mark = Fore.GREEN if item["status"] == "ok" else Fore.RED
+                print(f"{mark}[{item['status']}] {item['id']}{Style.RESET_ALL}")
+
+    writer = threading.Thread(target=write_results, name="writer", daemon=True)
+    writer.start()
+
+    # Feed (blocks when a queue is full). Text and bad entries skip ASR so
+    # they do not dilute its throughput; they reach the LLM queue before the
+    # ASR stage can send end-of-stream, because that needs our markers first.
+    start = time.perf_counter()
+    for item in pending:
+        if item["status"] != "pending":
+            q_llm.put(item)
+            continue
+        if not _is_text_item(item):
+            q_asr.put(item)
+            continue
+        try:
+            _load_text(item)
+        except OSError as e:
+            item["status"] = "error"
+            item["error"] = f"input: {e}"
+        q_llm.put(item)
+    for _ in range(asr_workers):
+        q_asr.put(_DONE)
+
+    for stage in stages:
+        stage.join()
+    writer.join()
+    wall = time.perf_counter() - start
+
+    stats = {stage.name: stage.stats() for stage in stages}
+    stats["total"] = {**counts, "wall_s": round(wall, 2)}
+    with open(os.path.join(out_dir, "batch_stats.json"), "w", encoding="utf-8") as f:
+        json.dump(stats, f, indent=2)
+    return stats
+
+# Calls ----------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a folder or manifest of recorded/typed student questions.")
+    parser.add_argument("source", help="directory of audio/.txt files, or a manifest (.jsonl or one path per line)")
+    parser.add_argument("--out", default="batch_out", help="output directory (results.jsonl, audio/, batch_stats.json)")
+    parser.add_argument("--model", default="gemma3:4b", help="Ollama model")
+    parser.add_argument("--asr-workers", type=int, default=1, help="ASR threads, each with its own Whisper models")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="max concurrent Ollama requests (see OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--tts", action="store_true", help="also synthesize each reply to a .wav")
+    parser.add_argument("--queue-size", type=int, default=8, help="bound on each inter-stage queue")
+    parser.add_argument("--fast-short", action="store_true", help="let Whisper tiny transcribe short clips")
+    args = parser.parse_args()
+
+    # Overnight runs never need a mic, speaker or hotkeys
+    profile = startup_profile(headless=True, workers=args.asr_workers)
+    stats = run_batch(
+        args.source,
+        args.out,
+        model=args.model,
+        asr_workers=args.asr_workers,
+        llm_concurrency=args.llm_concurrency,
+        tts=args.tts,
+        queue_size=args.queue_size,
+        fast_short=args.fast_short,
+        profile=profile,
+    )
+    print(f"{Fore.CYAN}Batch finished: {stats['total']}{Style.RESET_ALL}")
+    for name, s in stats.items():
+        if name != "total":
+            print(f"{Fore.CYAN}  {name:<4} {s}{Style.RESET_ALL}")
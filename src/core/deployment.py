@@ -0,0 +1,248 @@
+# Imports --------------------------------
+import os
+import sys
+import time
+import platform
+import numpy as np
+import torch
+import whisper
+from dataclasses import dataclass
+from colorama import Fore, Style, init
+from typing import Any, Dict, Optional
+
+# Audio devices are optional: PortAudio is often absent on servers
+try:
+    import sounddevice as sd
+except OSError:
+    sd = None
+
+# Initialize colorama
+init(autoreset=True)
+
+# Deployment profile ---------------------
+@dataclass
+class DeploymentProfile:
+    """
+    What this machine can do, decided at startup instead of assuming a Mac.
+    Every field can be forced through a RECAP_* environment variable.
+    """
+    system: str
+    machine: str
+    device: str           # cuda | mps | cpu
+    precision: str        # fp16 | fp32 | int8
+    has_audio_in: bool
+    has_audio_out: bool
+    has_hotkeys: bool
+    cpu_threads: int
+    interop_threads: int
+
+    @property
+    def headless(self) -> bool:
+        return not (self.has_audio_in or self.has_audio_out or self.has_hotkeys)
+
+    @property
+    def fp16(self) -> bool:
+        return self.precision == "fp16"
+
+    def summary(self) -> str:
+        io = "headless" if self.headless else (
+            f"mic={'yes' if self.has_audio_in else 'no'}, "
+            f"speaker={'yes' if self.has_audio_out else 'no'}, "
+            f"hotkeys={'yes' if self.has_hotkeys else 'no'}"
+        )
+        return (
+            f"{self.system}/{self.machine} on {self.device.upper()} ({self.precision}), "
+            f"{self.cpu_threads} threads / {self.interop_threads} inter-op, {io}"
+        )
+
+# Capability probes ----------------------
+def detect_device() -> str:
+    forced = os.getenv("RECAP_DEVICE")
+    if forced:
+        return forced
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+def _audio_channels() -> Dict[str, bool]:
+    if sd is None:
+        return {"in": False, "out": False}
+    try:
+        devices = sd.query_devices()
+    except Exception:
+        return {"in": False, "out": False}
+    return {
+        "in":  any(d.get("max_input_channels", 0) > 0 for d in devices),
+        "out": any(d.get("max_output_channels", 0) > 0 for d in devices),
+    }
+
+def _hotkeys_available() -> bool:
+    # pynput needs a window server on Linux (X11; Wayland is not supported)
+    if sys.platform.startswith("linux") and not os.getenv("DISPLAY"):
+        return False
+    try:
+        from pynput import keyboard  # noqa: F401
+    except Exception:
+        return False
+    return True
+
+def _usable_cpus() -> int:
+    # Respect cgroup/taskset limits rather than the host's core count
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def _int8_supported() -> bool:
+    return any(e != "none" for e in torch.backends.quantized.supported_engines)
+
+def detect_profile(headless: Optional[bool] = None, workers: int = 1) -> DeploymentProfile:
+    """
+    Probe the device, audio I/O and hotkey support. `headless` (or
+    RECAP_HEADLESS=1) disables all audio devices and hotkeys. The CPU
+    thread budget (RECAP_THREADS, default all usable CPUs) is split across
+    `workers` concurrent inference threads to avoid oversubscription.
+    """
+    if headless is None:
+        headless = os.getenv("RECAP_HEADLESS") == "1"
+
+    device = detect_device()
+    audio = {"in": False, "out": False} if headless else _audio_channels()
+
+    threads = max(1, int(os.getenv("RECAP_THREADS", _usable_cpus())) // max(1, workers))
+    # One request at a time: intra-op parallelism matters, inter-op barely
+    interop = int(os.getenv("RECAP_INTEROP_THREADS", 1 if threads <= 4 else 2))
+
+    precision = os.getenv("RECAP_PRECISION")
+    if precision is None:
+        if device != "cpu":
+            precision = "fp16"
+        else:
+            precision = "int8" if _int8_supported() else "fp32"
+    if precision not in ("fp16", "fp32", "int8"):
+        raise ValueError(f"RECAP_PRECISION must be fp16, fp32 or int8, not {precision!r}")
+    if device == "cpu" and precision == "fp16":
+        precision = "fp32"  # Whisper has no fp16 CPU kernels
+
+    return DeploymentProfile(
+        system=platform.system(),
+        machine=platform.machine(),
+        device=device,
+        precision=precision,
+        has_audio_in=audio["in"],
+        has_audio_out=audio["out"],
+        has_hotkeys=not headless and _hotkeys_available(),
+        cpu_threads=threads,
+        interop_threads=interop,
+    )
+
+# CPU tuning function --------------------
+def apply_cpu_tuning(profile: DeploymentProfile) -> None:
+    """
+    Pin torch's thread pools to the profile. Call before any model is
+    loaded: torch refuses to resize the inter-op pool once it has run.
+    """
+    torch.set_num_threads(profile.cpu_threads)
+    try:
+        torch.set_num_interop_threads(profile.interop_threads)
+    except RuntimeError:
+        print(f"{Fore.YELLOW}[Warning] Inter-op threads already started; keeping torch default.{Style.RESET_ALL}")
+    if profile.precision == "int8" and profile.machine.lower() in ("aarch64", "arm64"):
+        if "qnnpack" in torch.backends.quantized.supported_engines:
+            torch.backends.quantized.engine = "qnnpack"
+
+# Model precision function ---------------
+def optimize_whisper(model: Any, profile: DeploymentProfile) -> Any:
+    """
+    Apply the profile's precision to a loaded Whisper model. For int8,
+    Whisper's own Linear subclass is swapped for torch.nn.Linear so that
+    dynamic quantization recognises and replaces it.
+    """
+    if profile.precision != "int8" or profile.device != "cpu":
+        return model
+
+    targets = [
+        (parent, name, child)
+        for parent in model.modules()
+        for name, child in parent.named_children()
+        if isinstance(child, torch.nn.Linear) and type(child) is not torch.nn.Linear
+    ]
+    for parent, name, child in targets:
+        plain = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+        plain.load_state_dict(child.state_dict())
+        setattr(parent, name, plain)
+    return torch.ao.quantization.quantize_dynamic(model.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+# Startup self-test function -------------
+def _synchronize(device: str) -> None:
+    # GPU work is asynchronous: wait for it, or we only time the dispatch
+    if device == "cuda":
+        torch.cuda.synchronize()
+    elif device == "mps":
+        torch.mps.synchronize()
+
+def self_test(model: Any, profile: DeploymentProfile, runs: int = 3, steps: int = 32) -> Dict[str, float]:
+    """
+    Time the encoder on one 30 s window, a `steps`-token prompt prefill and
+    `steps` autoregressive decode steps with the kv-cache (how transcription
+    actually generates), then print the throughput of this configuration.
+    """
+    audio = np.zeros(whisper.audio.N_SAMPLES, dtype=np.float32)
+    mel = whisper.log_mel_spectrogram(audio, model.dims.n_mels).to(model.device)[None]
+    if profile.fp16:
+        mel = mel.half()
+    sot = whisper.tokenizer.get_tokenizer(model.is_multilingual).sot
+    prompt = torch.full((1, steps), sot, device=model.device)
+
+    def timed(fn) -> float:
+        fn()  # warm-up (kernel selection, allocator)
+        _synchronize(profile.device)
+        start = time.perf_counter()
+        for _ in range(runs):
+            fn()
+        _synchronize(profile.device)
+        return (time.perf_counter() - start) / runs
+
+    cache, hooks = model.install_kv_cache_hooks()
+
+    def decode() -> None:
+        cache.clear()
+        token = prompt[:, :1]
+        for _ in range(steps):
+            logits = model.decoder(token, features, kv_cache=cache)
+            token = logits[:, -1:].argmax(dim=-1)
+
+    try:
+        with torch.no_grad():
+            features = model.embed_audio(mel)
+            encoder_s = timed(lambda: model.embed_audio(mel))
+            prefill_s = timed(lambda: model.logits(prompt, features))
+            decode_s = timed(decode)
+    finally:
+        for hook in hooks:
+            hook.remove()
+
+    report = {
+        "encoder_ms": round(1000 * encoder_s, 1),
+        "realtime_x": round(whisper.audio.CHUNK_LENGTH / encoder_s, 1),
+        "prefill_tokens_per_s": round(steps / prefill_s, 1),
+        "decode_tokens_per_s": round(steps / decode_s, 1),
+    }
+    print(
+        f"{Fore.CYAN}Self-test [{profile.device}/{profile.precision}, {profile.cpu_threads} threads]: "
+        f"encoder {report['encoder_ms']} ms per 30 s window ({report['realtime_x']}x realtime), "
+        f"decode {report['decode_tokens_per_s']} tok/s (prefill {report['prefill_tokens_per_s']} tok/s){Style.RESET_ALL}"
+    )
+    return report
+
+# Calls ----------------------------------
+if __name__ == "__main__":
+    from session_asr import load_whisper
+
+    profile = detect_profile()
+    apply_cpu_tuning(profile)
+    print(f"{Fore.CYAN}Profile: {profile.summary()}{Style.RESET_ALL}")
+    asr = optimize_whisper(load_whisper(os.getenv("RECAP_WHISPER_MODEL", "medium"), profile.device), profile)
+    self_test(asr, profile)
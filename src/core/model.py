@@ -2,48 +2,66 @@
 import os
 import time
 import tempfile
-import platform
-import sounddevice as sd
 import soundfile as sf
 import numpy as np
-import torch
-import whisper
 import ollama
 import threading
 from colorama import Fore, Style, init
 from speak import speak, VOICE_MAP, USER_VARIANT_CHOICE
-from pynput import keyboard
-from pynput.keyboard import Listener
+from session_asr import SessionASR, load_whisper
+from deployment import DeploymentProfile, detect_profile, apply_cpu_tuning, optimize_whisper, self_test
 from typing import Tuple, Any, Dict, Optional
 
+# Audio and hotkeys are optional: headless Linux has neither PortAudio nor X
+try:
+    import sounddevice as sd
+except OSError:
+    sd = None
+try:
+    from pynput import keyboard
+    from pynput.keyboard import Listener
+except Exception:
+    keyboard = None
+    Listener = Any
+
 # Initialize colorama
 init(autoreset=True)
 
-# Ensure macOS function ------------------
-def ensureMac() -> None:
-    if platform.system() != "Darwin":
-        raise OSError("This program is macOS-specific; please run on a Mac.")
+# Startup profile function --------------
+def startup_profile(headless: Optional[bool] = None, workers: int = 1) -> DeploymentProfile:
+    """
+    Detect what this machine offers (replaces the old macOS-only guard)
+    and tune torch's CPU thread pools before any model is loaded.
+    """
+    profile = detect_profile(headless, workers)
+    apply_cpu_tuning(profile)
+    print(f"{Fore.CYAN}Profile: {profile.summary()}{Style.RESET_ALL}")
+    return profile
 
 # Determine device function --------------
-def determine_device() -> Tuple[Any, str]:
-    if torch.backends.mps.is_available():
-        device = "mps"
-    else:
-        device = "cpu"
-  
-    print(f"{Fore.CYAN}Loading Whisper medium on CPU to patch sparse weights...{Style.RESET_ALL}")
-    asr = whisper.load_model("medium", device="cpu")
-    # Patching sparse buffers now
-    for name, buf in list(asr.named_buffers()):
-        if buf.layout == torch.sparse_coo:
-            asr.register_buffer(name, buf.to_dense())
-    # Finalizing
-    print(f"{Fore.CYAN}Moving Whisper model to {device.upper()}...{Style.RESET_ALL}")
-    asr = asr.to(device)
-    return asr, device
+def determine_device(profile: Optional[DeploymentProfile] = None) -> Tuple[Any, str]:
+    profile = profile or detect_profile(headless=True)
+    asr = optimize_whisper(load_whisper("medium", profile.device), profile)
+    return asr, profile.device
+
+# Session ASR function -------------------
+def build_session_asr(asr: Any, device: str, fast_short: bool = False, profile: Optional[DeploymentProfile] = None) -> SessionASR:
+    """
+    Pair the medium model with Whisper tiny for language ID (and, with
+    `fast_short`, for short utterances) and return a per-session ASR.
+    """
+    detector = load_whisper("tiny", device)
+    fp16 = None
+    if profile is not None:
+        detector = optimize_whisper(detector, profile)
+        fp16 = profile.fp16
+    return SessionASR(asr, device, detector=detector, fast_short=fast_short, fp16=fp16)
 
 # Detect microphone function -------------
 def determineIf_mic_available() -> bool:
+    if sd is None:
+        print(f"{Fore.YELLOW}[Warning] No audio backend available. Voice mode disabled.{Style.RESET_ALL}")
+        return False
     try:
         input_devices = [d for d in sd.query_devices() if d.get("max_input_channels",0)>0]
         has_mic = len(input_devices) > 0
@@ -82,13 +100,17 @@ LANGUAGE_GROUPS = {
 # Flag for language-picker override
 selecting_language = False
 
+# Session ASR (set at startup), remembers the student's language
+session_asr: Optional[SessionASR] = None
+
 def on_hotkey_start_language_selection():
     """
     Hotkey callback: stop any audio and signal the chat loop
     to open the language picker on next iteration.
     """
     global selecting_language
-    sd.stop()
+    if sd is not None:
+        sd.stop()
     selecting_language = True
 
 def choose_language_variant() -> Optional[str]:
@@ -99,7 +121,8 @@ def choose_language_variant() -> Optional[str]:
     """
     global selecting_language
     selecting_language = True
-    sd.stop()
+    if sd is not None:
+        sd.stop()
 
     def clear():
         # ANSI clear-screen
@@ -150,6 +173,8 @@ def choose_language_variant() -> Optional[str]:
                 if confirm == "y":
                     base = chosen.split("-",1)[0]
                     USER_VARIANT_CHOICE[base] = chosen
+                    if session_asr is not None:
+                        session_asr.set_language(chosen)
                     clear()
                     print(f"✔️  {lang_name} set to {chosen} ({VOICE_MAP[chosen]})"); time.sleep(1)
                     return chosen
@@ -175,7 +200,8 @@ def setup_hotkeys_and_listeners() -> Listener:
         print(f"\n{Fore.MAGENTA}*** Voice output {state} ***{Style.RESET_ALL}")
 
     def stop_speaking():
-        sd.stop()
+        if sd is not None:
+            sd.stop()
         print(f"\n{Fore.MAGENTA}*** Voice stopped ***{Style.RESET_ALL}")
 
     hotkey_mode = keyboard.HotKey(
@@ -253,7 +279,7 @@ def get_voice_input(
     with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
         sf.write(tmp.name, wav, fs)
         print(f"{Fore.BLUE}Transcribing...{Style.RESET_ALL}")
-        result = asr.transcribe(tmp.name, fp16=(device!="cpu"), condition_on_previous_text=False)
+        result = session_asr.transcribe(tmp.name)
     os.remove(tmp.name)
 
     txt = result.get("text","").strip()
@@ -312,7 +338,7 @@ def load_farewells() -> str:
     return FAREWELL_TOKENS
 
 # Warm-up system function ----------------
-def warmup() -> None:
+def warmup(with_tts: bool = True) -> None:
     global model_ready
     try:
         # Model Specific Warmup
@@ -321,7 +347,8 @@ def warmup() -> None:
         print(f"{Fore.GREEN}Model warmed up and ready for conversation.{Style.RESET_ALL}")
 
         # TTS specific warmup
-        speak("TTS warmup", False, "en")
+        if with_tts:
+            speak("TTS warmup", False, "en")
     except Exception as e:
         raise RuntimeError(f"{Fore.RED}Model could not be warmed up. {e}.{Style.RESET_ALL}")
 
@@ -379,21 +406,28 @@ def chat(modelIn: str) -> None:
             conversation_history.append({"role": "assistant", "content": bot_reply})
     except KeyboardInterrupt:
         print(f"\n{Fore.RED}Interrupted! Exiting...{Style.RESET_ALL}")
+    finally:
+        if session_asr is not None:
+            session_asr.report()
 
 # Calls ----------------------------------
 if __name__ == "__main__":
     # 1) Platform and Devices
-    ensureMac()
-    asr, device = determine_device()
-    has_mic = determineIf_mic_available()
+    profile = startup_profile()
+    asr, device = determine_device(profile)
+    session_asr = build_session_asr(asr, device, fast_short=os.getenv("RECAP_ASR_FAST_SHORT") == "1", profile=profile)
+    if os.getenv("RECAP_SELF_TEST", "1") != "0":
+        self_test(asr, profile)
+    has_mic = profile.has_audio_in and determineIf_mic_available()
     use_voice = has_mic
-    use_tts = True
+    use_tts = profile.has_audio_out
 
     # 2a) Hotkeys
-    setup_hotkeys_and_listeners()
-    
+    if profile.has_hotkeys and keyboard is not None:
+        setup_hotkeys_and_listeners()
+
     # 2b) Warmup
-    warmup_thread = threading.Thread(target = warmup)
+    warmup_thread = threading.Thread(target = warmup, args = (use_tts,))
     warmup_thread.start()
     warmup_thread.join()
 
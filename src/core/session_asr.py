@@ -0,0 +1,263 @@
+# Imports --------------------------------
+import time
+import threading
+import numpy as np
+import torch
+import whisper
+from colorama import Fore, Style
+from typing import Any, Dict, List, Optional, Tuple
+
+# Locale bases from VOICE_MAP that Whisper knows under another code
+WHISPER_LANG_ALIASES = {
+    "arb": "ar",
+    "cmn": "zh",
+    "yue": "zh",
+    "nb":  "no",
+}
+
+# Load Whisper model function ------------
+def load_whisper(name: str, device: str) -> Any:
+    """
+    Load a Whisper checkpoint on CPU, densify sparse buffers (MPS cannot
+    hold them), then move it to `device`.
+    """
+    print(f"{Fore.CYAN}Loading Whisper {name} on CPU to patch sparse weights...{Style.RESET_ALL}")
+    model = whisper.load_model(name, device="cpu")
+    for buf_name, buf in list(model.named_buffers()):
+        if buf.layout == torch.sparse_coo:
+            model.register_buffer(buf_name, buf.to_dense())
+    print(f"{Fore.CYAN}Moving Whisper {name} to {device.upper()}...{Style.RESET_ALL}")
+    return model.to(device)
+
+# Locale to Whisper code function --------
+def to_whisper_language(code: Optional[str]) -> Optional[str]:
+    """
+    Map a locale such as "en-US", "cmn-CN" or "arb" to the code Whisper
+    expects ("en", "zh", "ar"). Returns None for unknown languages.
+    """
+    if not code:
+        return None
+    base = code.strip().split("-", 1)[0].lower()
+    base = WHISPER_LANG_ALIASES.get(base, base)
+    return base if base in whisper.tokenizer.LANGUAGES else None
+
+# Per-tier counters ----------------------
+class TierStats:
+    """
+    Latency and confidence counters for one ASR tier. Whisper gives no
+    ground truth, so accuracy is tracked through its own confidence
+    signals: mean log-probability (transcription tiers), mean detection
+    probability (language-ID tiers), low-confidence results and how often
+    this tier's answer had to be escalated or was overruled. Means cover
+    only calls that produced the signal, and are None when none did.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.audio_seconds = 0.0
+        self.logprob_sum = 0.0
+        self.logprob_samples = 0
+        self.lang_prob_sum = 0.0
+        self.lang_prob_samples = 0
+        self.low_confidence = 0
+        self.escalated = 0
+        self.overruled = 0
+
+    def record(self, latency: float, audio_seconds: float,
+               logprob: Optional[float] = None, lang_prob: Optional[float] = None) -> None:
+        self.calls += 1
+        self.seconds += latency
+        self.audio_seconds += audio_seconds
+        if logprob is not None:
+            self.logprob_sum += logprob
+            self.logprob_samples += 1
+        if lang_prob is not None:
+            self.lang_prob_sum += lang_prob
+            self.lang_prob_samples += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        calls = max(self.calls, 1)
+        return {
+            "calls": self.calls,
+            "mean_latency_ms": round(1000 * self.seconds / calls, 1),
+            "realtime_factor": round(self.seconds / self.audio_seconds, 3) if self.audio_seconds else None,
+            "mean_logprob": round(self.logprob_sum / self.logprob_samples, 3) if self.logprob_samples else None,
+            "mean_lang_prob": round(self.lang_prob_sum / self.lang_prob_samples, 3) if self.lang_prob_samples else None,
+            "low_confidence": self.low_confidence,
+            "escalated": self.escalated,
+            "overruled": self.overruled,
+        }
+
+# Session-aware ASR ----------------------
+class SessionASR:
+    """
+    Wraps Whisper for one chat session.
+
+    Once a language is known (detected or picked via the language menu) it is
+    passed to every transcription as a hint, so the primary model never pays
+    for language detection again. While it is unknown, the small `detector`
+    model identifies the language; if it is unsure, the primary model decides.
+    A detected language is only pinned when its detection probability reaches
+    `lang_confidence`, and a non-empty, low-confidence result under it unpins
+    it again. A language the user chose stays pinned until they change it.
+    With `fast_short=True`, utterances shorter than `short_seconds` are first
+    transcribed by the detector and escalated to the primary model when the
+    result looks unreliable.
+    """
+
+    SAMPLE_RATE = whisper.audio.SAMPLE_RATE
+
+    def __init__(
+        self,
+        primary: Any,
+        device: str,
+        detector: Optional[Any] = None,
+        language: Optional[str] = None,
+        fast_short: bool = False,
+        short_seconds: float = 4.0,
+        lang_confidence: float = 0.7,
+        logprob_threshold: float = -1.0,
+        compression_threshold: float = 2.4,
+        fp16: Optional[bool] = None,
+    ) -> None:
+        self.primary = primary
+        self.detector = detector
+        self.device = device
+        self.fp16 = (device != "cpu") if fp16 is None else fp16
+        self.language = to_whisper_language(language)
+        self.user_pinned = self.language is not None
+        self.fast_short = fast_short
+        self.short_seconds = short_seconds
+        self.lang_confidence = lang_confidence
+        self.logprob_threshold = logprob_threshold
+        self.compression_threshold = compression_threshold
+        self.stats = {tier: TierStats(tier) for tier in ("lang_id", "lang_id_medium", "tiny", "medium")}
+        self._lock = threading.Lock()
+
+    # Language hint ----------------------
+    def set_language(self, code: Optional[str], from_user: bool = True) -> None:
+        """
+        Pin the session language (e.g. from choose_language_variant()).
+        User pins are never dropped automatically; detected ones
+        (`from_user=False`) are dropped when results under them look wrong.
+        """
+        with self._lock:
+            self.language = to_whisper_language(code)
+            self.user_pinned = from_user and self.language is not None
+
+    def reset_language(self) -> None:
+        """Forget the session language; the next utterance is detected again."""
+        with self._lock:
+            self.language = None
+            self.user_pinned = False
+
+    # Transcription ----------------------
+    def transcribe(self, path: str) -> Dict[str, Any]:
+        """
+        Transcribe an audio file. Returns Whisper's result dict, with
+        "language" always set and "tier" naming the model that produced it.
+        """
+        audio = whisper.load_audio(path)
+        duration = len(audio) / self.SAMPLE_RATE
+
+        with self._lock:
+            pinned, user_pinned = self.language, self.user_pinned
+        language, lang_prob, guess = pinned, None, None
+        if language is None and self.detector is not None:
+            guess, lang_prob = self._detect_language("lang_id", self.detector, audio, duration)
+            if lang_prob >= self.lang_confidence:
+                language = guess
+            else:
+                self.stats["lang_id"].low_confidence += 1
+                self.stats["lang_id"].escalated += 1
+        if language is None:
+            # Tiny unsure (or absent): medium decides, and we keep its probability
+            language, lang_prob = self._detect_language("lang_id_medium", self.primary, audio, duration)
+            if guess is not None and language != guess:
+                self.stats["lang_id"].overruled += 1
+            if lang_prob < self.lang_confidence:
+                self.stats["lang_id_medium"].low_confidence += 1
+
+        result = None
+        if self.fast_short and self.detector is not None and duration < self.short_seconds:
+            result = self._run("tiny", self.detector, audio, duration, language)
+            if self._is_confident(result):
+                result["tier"] = "tiny"
+            else:
+                self.stats["tiny"].low_confidence += 1
+                self.stats["tiny"].escalated += 1
+                result = None
+
+        if result is None:
+            result = self._run("medium", self.primary, audio, duration, language)
+            result["tier"] = "medium"
+            if not self._is_confident(result):
+                self.stats["medium"].low_confidence += 1
+
+        result["language"] = language
+        has_text = bool(result.get("text", "").strip())
+        confident = has_text and self._is_confident(result)
+        if pinned is not None:
+            # A poor transcript under a detected hint may mean the student
+            # switched language; silence says nothing about the language
+            if has_text and not confident and not user_pinned:
+                with self._lock:
+                    # Unless the user picked a language meanwhile
+                    if not self.user_pinned:
+                        self.language = None
+        elif confident and lang_prob >= self.lang_confidence:
+            # Pin only when both the language ID and the transcript are trustworthy
+            self.set_language(language, from_user=False)
+        return result
+
+    def _detect_language(self, tier: str, model: Any, audio: np.ndarray, duration: float) -> Tuple[str, float]:
+        start = time.perf_counter()
+        segment = whisper.pad_or_trim(audio)
+        mel = whisper.log_mel_spectrogram(segment, model.dims.n_mels).to(model.device)
+        with torch.no_grad():
+            _, probs = model.detect_language(mel)
+        language = max(probs, key=probs.get)
+        self.stats[tier].record(time.perf_counter() - start, min(duration, 30.0), lang_prob=probs[language])
+        return language, probs[language]
+
+    def _run(self, tier: str, model: Any, audio: np.ndarray, duration: float, language: Optional[str]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        result = model.transcribe(
+            audio,
+            language=language,
+            fp16=self.fp16,
+            condition_on_previous_text=False,
+        )
+        self.stats[tier].record(time.perf_counter() - start, duration, self._mean_logprob(result))
+        return result
+
+    # Confidence -------------------------
+    @staticmethod
+    def _mean_logprob(result: Dict[str, Any]) -> Optional[float]:
+        segments: List[Dict[str, Any]] = result.get("segments") or []
+        weights = [max(s["end"] - s["start"], 1e-3) for s in segments]
+        if not segments:
+            return None
+        return sum(s["avg_logprob"] * w for s, w in zip(segments, weights)) / sum(weights)
+
+    def _is_confident(self, result: Dict[str, Any]) -> bool:
+        segments = result.get("segments") or []
+        if not segments:
+            return False
+        logprob = self._mean_logprob(result)
+        worst_ratio = max(s.get("compression_ratio", 0.0) for s in segments)
+        return logprob >= self.logprob_threshold and worst_ratio <= self.compression_threshold
+
+    # Reporting --------------------------
+    def stats_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {tier: s.as_dict() for tier, s in self.stats.items()}
+
+    def report(self) -> None:
+        source = "chosen" if self.user_pinned else "detected"
+        language = f"{self.language} ({source})" if self.language else "auto"
+        print(f"{Fore.CYAN}ASR session language: {language}{Style.RESET_ALL}")
+        for tier, s in self.stats_dict().items():
+            if s["calls"]:
+                print(f"{Fore.CYAN}  {tier:<14} {s}{Style.RESET_ALL}")
@@ -1,14 +1,17 @@
 # speak.py
 
 import os
-import platform
+import threading
 import boto3
-import sounddevice as sd
 import numpy as np
 
-# ─── 1) macOS guard ─────────────────────────────────────────────────────────
-if platform.system() != "Darwin":
-    raise OSError("This TTS helper is macOS-specific; please run on a Mac.")
+# ─── 1) Audio output (optional) ─────────────────────────────────────────────
+# Headless boxes may lack PortAudio entirely; synthesis still works there,
+# only playback is skipped.
+try:
+    import sounddevice as sd
+except OSError:
+    sd = None
 
 # ─── 2) AWS credentials ─────────────────────────────────────────────────────
 # boto3 will pick up AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY,
@@ -65,16 +68,23 @@ VOICE_MAP = {
 }
 
 VOICE_ENGINES: dict[str, set[str]] = {}
+_VOICE_ENGINES_LOCK = threading.Lock()
 def _load_voice_engines():
-    # This will page through all voices if necessary
+    # Fill a local dict and publish it whole, so concurrent callers never
+    # see a half-paginated table (and pick an engine the voice lacks)
+    engines: dict[str, set[str]] = {}
     paginator = polly.get_paginator("describe_voices")
     for page in paginator.paginate():
         for v in page["Voices"]:
-            VOICE_ENGINES[v["Id"]] = set(v.get("SupportedEngines", []))
-
-_load_voice_engines()
+            engines[v["Id"]] = set(v.get("SupportedEngines", []))
+    VOICE_ENGINES.update(engines)
 
 def _select_engine(voice_id: str) -> str:
+    # Loaded on first use so text-only deployments never touch Polly
+    if not VOICE_ENGINES:
+        with _VOICE_ENGINES_LOCK:
+            if not VOICE_ENGINES:
+                _load_voice_engines()
     engines = VOICE_ENGINES.get(voice_id, set())
     # prefer neural, then standard, then any other
     for choice in ("neural", "standard"):
@@ -85,6 +95,17 @@ def _select_engine(voice_id: str) -> str:
 
 USER_VARIANT_CHOICE: dict[str, str] = {}
 
+# Variant used for a bare base when nobody is around to pick one
+DEFAULT_VARIANT = {
+    "ar": "ar-AE",
+    "en": "en-US",
+    "de": "de-DE",
+    "es": "es-ES",
+    "fr": "fr-FR",
+    "nl": "nl-NL",
+    "pt": "pt-BR",
+}
+
 def _choose_variant(base: str) -> str:
     variants = [
         k for k in VOICE_MAP
@@ -100,11 +121,12 @@ def _choose_variant(base: str) -> str:
             return variants[idx-1]
         print("  Invalid choice, try again.")
 
-def _normalize_lang(code: str) -> str:
+def _normalize_lang(code: str, interactive: bool = True) -> str:
     """
     1) If the user has previously picked a variant for this base, use that
     2) Else if code exactly matches a VOICE_MAP key, use it
-    3) Else if it's a base with multiple variants, prompt (or use stored)
+    3) Else if it's a base with multiple variants, prompt (or use stored);
+       when not interactive, use DEFAULT_VARIANT or the first variant
     4) Else fallback to en-US
     """
     code_norm = code.strip()
@@ -124,6 +146,8 @@ def _normalize_lang(code: str) -> str:
         k for k in VOICE_MAP
         if k.split("-", 1)[0].lower() == base.lower()
     ]
+    if len(variants) > 1 and not interactive:
+        return VOICE_MAP[DEFAULT_VARIANT.get(base.lower(), sorted(variants)[0])]
     if len(variants) > 1:
         chosen = USER_VARIANT_CHOICE.get(base) or _choose_variant(base)
         return VOICE_MAP[chosen]
@@ -132,12 +156,15 @@ def _normalize_lang(code: str) -> str:
 
     # 4) ultimate fallback
     return VOICE_MAP["en-US"]
-# ─── 4) speak() ─────────────────────────────────────────────────────────────
-def speak(text: str, play: bool, language: str = "en") -> None:
+# ─── 4) synthesize() / speak() ──────────────────────────────────────────────
+SAMPLE_RATE = 16000
+
+def synthesize(text: str, language: str = "en", interactive: bool = True) -> np.ndarray:
     """
-    Synthesize `text` via Amazon Polly and play it.
+    Synthesize `text` via Amazon Polly and return 16 kHz int16 PCM
+    (empty if Polly returned nothing).
     """
-    voice_id = _normalize_lang(language)
+    voice_id = _normalize_lang(language, interactive)
     engine = _select_engine(voice_id)
     resp = polly.synthesize_speech(
         Text=text,
@@ -148,10 +175,14 @@ def speak(text: str, play: bool, language: str = "en") -> None:
     stream = resp.get("AudioStream")
     if not stream:
         print(f"[Error] Polly returned no audio (voice={voice_id}).")
-        return
+        return np.zeros(0, dtype=np.int16)
+    return np.frombuffer(stream.read(), dtype=np.int16)
 
-    pcm = stream.read()
-    audio = np.frombuffer(pcm, dtype=np.int16)
-    if play and audio.size > 0:
-        sd.play(audio, samplerate=16000)
+def speak(text: str, play: bool, language: str = "en") -> None:
+    """
+    Synthesize `text` via Amazon Polly and play it.
+    """
+    audio = synthesize(text, language)
+    if play and audio.size > 0 and sd is not None:
+        sd.play(audio, samplerate=SAMPLE_RATE)
         sd.wait()